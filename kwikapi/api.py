@@ -3,19 +3,22 @@ from future.standard_library import install_aliases
 
 install_aliases()
 
-import ast
+import os
 import abc
 import time
+import random
 import inspect
-import traceback
-from urllib.parse import parse_qs, urlparse
+import collections.abc
+from urllib.parse import urlparse
 import typing
+import weakref
+import threading
 import concurrent.futures
 
-from deeputil import Dummy, AttrDict, generate_random_string
+from deeputil import Dummy
 from requests.structures import CaseInsensitiveDict
 
-from .protocols import PROTOCOLS, DEFAULT_PROTOCOL
+from .protocols import PROTOCOLS, DEFAULT_PROTOCOL, RawProtocol
 from .apidoc import ApiDoc
 
 from .exception import DuplicateAPIFunction, UnknownAPIFunction
@@ -23,7 +26,7 @@ from .exception import ProtocolAlreadyExists, UnknownProtocol
 from .exception import UnsupportedType, TypeNotSpecified
 from .exception import KeywordArgumentError
 
-from .utils import get_loggable_params
+from .utils import get_loggable_params, get_converter, liteval, parse_query
 
 DUMMY_LOG = Dummy()
 
@@ -31,6 +34,79 @@ PROTOCOL_HEADER = "X-KwikAPI-Protocol"
 REQUEST_ID_HEADER = "X-KwikAPI-RequestID"
 TIMING_HEADER = "X-KwikAPI-Timing"
 
+# APIFragment class -> names of its API methods
+_API_FN_NAMES = weakref.WeakKeyDictionary()
+
+_getrandbits = random.getrandbits
+
+
+class _SharedThreadPool(concurrent.futures.ThreadPoolExecutor):
+    """
+    The threadpool that API objects use by default. It belongs to
+    the module rather than to any one API, so shutting it down
+    through an API's threadpool attribute does nothing (that would
+    break every other API using it).
+    """
+
+    def shutdown(self, wait=True, **kwargs):
+        pass
+
+
+_THREADPOOL = None
+_THREADPOOL_LOCK = threading.Lock()
+
+
+def get_default_threadpool():
+    """
+    Returns the threadpool shared by all API objects that are not
+    given a threadpool (or a threadpool size). Sized by the number
+    of cpus, but capped at 32 threads.
+    """
+    global _THREADPOOL
+
+    with _THREADPOOL_LOCK:
+        if _THREADPOOL is None:
+            _THREADPOOL = _SharedThreadPool(
+                max_workers=min(32, (os.cpu_count() or 1) * 2 + 4)
+            )
+
+    return _THREADPOOL
+
+
+def _new_request_id():
+    """
+    Returns a random 5 character hex string to tell requests apart
+    in the logs. Only needs to be unique-ish, so there is no need
+    to go to os.urandom for it.
+    """
+    return "%05x" % _getrandbits(20)
+
+
+def _is_generator_type(_type):
+    """
+    Tells if an annotation is typing.Generator, bare or
+    subscripted (eg: Generator[int, None, None])
+    """
+    return _type is typing.Generator or getattr(_type, "__origin__", None) in (
+        typing.Generator,
+        collections.abc.Generator,
+    )
+
+
+class _CallInfo:
+    """
+    What _resolve_call_info found out about a request
+    """
+
+    __slots__ = ("time_deserialize", "namespace", "function", "method", "gives_stream")
+
+    def __init__(self):
+        self.time_deserialize = 0.0
+        self.namespace = None
+        self.function = None
+        self.method = "GET"
+        self.gives_stream = False
+
 
 class Counter:
     def __init__(self, v=0):
@@ -57,7 +133,7 @@ class BaseRequest(object):
         self.response = None
         self.protocol = None
         self.metrics = {}
-        self._id = generate_random_string(length=5)
+        self._id = _new_request_id()
         self.auth = None
 
     @property
@@ -90,6 +166,11 @@ Request = BaseRequest
 class BaseResponse(object):
     __metaclass__ = abc.ABCMeta
 
+    # When set, streamed records are coalesced into chunks of at least
+    # this many bytes before being yielded, so that transports make fewer
+    # (larger) writes. Off by default as it delays records of slow streams.
+    STREAM_CHUNK_SIZE = 0
+
     def __init__(self):
         self.raw_response = None
 
@@ -99,24 +180,54 @@ class BaseResponse(object):
         C = Counter
 
         if not stream:
-            t = time.time()
+            t = time.perf_counter()
             self._data = protocol.serialize(data)
-            return C(len(self._data)), C(time.time() - t)
+            return C(len(self._data)), C(time.perf_counter() - t)
 
         n = C(0)
         t = C(0.0)
 
         def fn():
-            for x in data:
-                _t = time.time()
-                d = protocol.serialize(x)
-                t.increment(time.time() - _t)
-
-                s = protocol.get_record_separator()
-                n.increment(len(d) + len(s))
-
-                yield d
-                yield s
+            s = protocol.get_record_separator()
+            if isinstance(s, str):
+                s = s.encode("utf-8")
+
+            # accumulate in locals rather than calling into the
+            # counters for every record
+            timer = time.perf_counter
+            serialize = protocol.serialize
+            chunk_size = self.STREAM_CHUNK_SIZE
+            buf = bytearray()
+            _n, _t = 0, 0.0
+            try:
+                for x in data:
+                    t0 = timer()
+                    d = serialize(x)
+                    _t += timer() - t0
+
+                    if isinstance(d, str):
+                        d = d.encode("utf-8")
+
+                    # one chunk per record so that the record and its
+                    # separator don't go out as two separate writes
+                    if s:
+                        d += s
+                    _n += len(d)
+
+                    if not chunk_size:
+                        yield d
+                        continue
+
+                    buf += d
+                    if len(buf) >= chunk_size:
+                        yield bytes(buf)
+                        del buf[:]
+
+                if buf:
+                    yield bytes(buf)
+            finally:
+                n.increment(_n)
+                t.increment(_t)
 
         self._data = fn()
 
@@ -232,7 +343,12 @@ class API(object):
         Request,
     ] + TYPING_ANNOTATIONS
 
-    THREADPOOL_SIZE = 32
+    # modules whose types are accepted as annotations as is
+    ALLOWED_MODULES = frozenset(("typing", "builtins"))
+
+    # None means use the threadpool shared by all API objects
+    THREADPOOL_SIZE = None
+    ROUTE_CACHE_SIZE = 1024
 
     def __init__(
         self,
@@ -245,24 +361,48 @@ class API(object):
     ):
 
         self._api_funcs = {}
+        # versions that have at least one registered API function
+        self._versions = set()
+        # url path -> (fn_name, namespace, api fn), filled in by request handlers
+        self._routes = {}
         self._auth = auth
         self.log = log.bind(api_id=id)
         self._id = id
         self.default_version = default_version
 
+        # classes that annotations are allowed to be subclasses of
+        # (objects from the typing module are checked by module instead)
+        self._allowed_classes = tuple(
+            t
+            for t in self.ALLOWED_ANNOTATIONS
+            if isinstance(t, type) and t.__module__ != "typing"
+        )
+        # ids of the annotations that have already passed _check_type,
+        # mapped to the annotation (which also keeps the id from being
+        # reused); keyed by identity because typing objects of different
+        # kinds can compare equal (eg: int | None == Optional[int])
+        self._checked_types = {}
+
         self.threadpool = None
 
         if threadpool:
             self.threadpool = threadpool
-        else:
-            if threadpool_size:
-                self.threadpool = concurrent.futures.ThreadPoolExecutor(
-                    max_workers=threadpool_size
-                )
+        elif threadpool_size is None:
+            self.threadpool = get_default_threadpool()
+        elif threadpool_size:
+            self.threadpool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=threadpool_size
+            )
 
         self.register(ApiDoc(self._api_funcs), "v1")
 
     def _get_fn_info(self, fn):
+        # function signatures don't change at runtime, so the info
+        # computed on first registration is reused from then on
+        info = getattr(fn.__func__, "func_info", None)
+        if info is not None:
+            return info
+
         argspec = inspect.getfullargspec(fn)
         args, defaults, annotations = (
             argspec.args,
@@ -294,12 +434,9 @@ class API(object):
 
             params[arg] = dict(required=False, default=val, type=_type)
 
-        try:
-            _return_type = annotations["return"]
-        except KeyError:
-            _return_type = "None"
+        _return_type = annotations.get("return", "None")
 
-        stream = True if _return_type == typing.Generator else False
+        stream = _is_generator_type(_return_type)
 
         info = dict(
             doc=fn.__doc__, params=params, return_type=_return_type, gives_stream=stream
@@ -311,45 +448,119 @@ class API(object):
         fn.__func__.func_info = info
         return info
 
+    def _make_params_parser(self, params):
+        """
+        Builds the function that parses the query string
+        parameters of an API function, with the converter
+        of every parameter resolved up front
+        """
+        get_conv = dict((k, get_converter(v["type"])) for k, v in params.items()).get
+
+        def parse_params(query_string):
+            param_vals = parse_query(query_string)
+            for key, val in param_vals.items():
+                param_vals[key] = get_conv(key, liteval)(val)
+
+            return param_vals
+
+        return parse_params
+
+    def _get_api_fn_names(self, fragment_cls):
+        fn_names = _API_FN_NAMES.get(fragment_cls)
+        if fn_names is not None:
+            return fn_names
+
+        # walking the class dicts (instead of inspect.getmembers) avoids
+        # calling getattr, and so triggering descriptors like properties,
+        # on every attribute of the fragment
+        fn_names = []
+        seen = set()
+        for cls in fragment_cls.__mro__:
+            for fn_name, attr in vars(cls).items():
+
+                # skipping non-public methods and overridden ones
+                if fn_name.startswith("_") or fn_name in seen:
+                    continue
+                seen.add(fn_name)
+
+                if inspect.isfunction(attr) or isinstance(attr, classmethod):
+                    fn_names.append(fn_name)
+
+        _API_FN_NAMES[fragment_cls] = fn_names
+        return fn_names
+
     def _discover_funcs(self, api_fragment, version, namespace):
         api_funcs = {}
 
-        for fn_name, fn in inspect.getmembers(api_fragment, predicate=inspect.ismethod):
+        for fn_name in self._get_api_fn_names(type(api_fragment)):
+            fn = getattr(api_fragment, fn_name)
+            if inspect.ismethod(fn):
+                api_funcs[(version, fn_name, namespace)] = self._make_api_fn(fn)
 
-            # skipping non-public methods
-            if fn_name.startswith("_"):
+        # bound methods can also be set on the instance itself
+        # (eg: self.add = Impl().add in a facade's __init__)
+        for fn_name, fn in getattr(api_fragment, "__dict__", {}).items():
+            key = (version, fn_name, namespace)
+            if fn_name.startswith("_") or key in api_funcs:
                 continue
 
-            fn_info = self._get_fn_info(fn)
-            api_funcs[(version, fn_name, namespace)] = dict(obj=fn, info=fn_info)
+            if inspect.ismethod(fn):
+                api_funcs[key] = self._make_api_fn(fn)
 
         return api_funcs
 
-    def _check_type(self, _type):
-        for allowed_type in self.ALLOWED_ANNOTATIONS:
-            try:
-                if _type == type(None) or _type == None:
-                    break
-                if issubclass(_type, allowed_type):
-                    break
-            except TypeError:
-                try:
-                    if _type.__module__ in ("typing", "builtins"):
-                        break
-                    else:
-                        raise UnsupportedType(_type)
-                except AttributeError:
-                    raise UnsupportedType(_type)
+    def _make_api_fn(self, fn):
+        fn_info = self._get_fn_info(fn)
+        params = fn_info["params"]
+
+        for stream_param, p in params.items():
+            if _is_generator_type(p["type"]):
+                break
         else:
+            stream_param = None
+
+        return dict(
+            obj=fn,
+            info=fn_info,
+            gives_stream=fn_info["gives_stream"],
+            stream_param=stream_param,
+            has_req="req" in fn_info,
+            parse_params=self._make_params_parser(params),
+        )
+
+    def _check_type(self, _type):
+        if _type is None or _type is type(None):
+            return
+
+        if id(_type) in self._checked_types:
+            return
+
+        if not (
+            isinstance(_type, type)
+            and issubclass(_type, self._allowed_classes)
+            or getattr(_type, "__module__", None) in self.ALLOWED_MODULES
+        ):
             raise UnsupportedType(_type)
 
+        self._checked_types[id(_type)] = _type
+
     def _check_type_info(self, _type):
-        try:
-            for arg in _type.__args__:
-                self._check_type_info(arg)
+        # walks the type arguments of (nested) generics like
+        # Dict[str, List[int]], checking each distinct one once
+        seen = set()
+        stack = [_type]
+        while stack:
+            args = getattr(stack.pop(), "__args__", None)
+            if not isinstance(args, tuple):
+                continue
+
+            for arg in args:
+                if id(arg) in seen:
+                    continue
+                seen.add(id(arg))
+
                 self._check_type(arg)
-        except (AttributeError, TypeError):
-            pass
+                stack.append(arg)
 
     def _ensure_type_annotations(self, funcs):
         for fn in funcs.values():
@@ -380,13 +591,13 @@ class API(object):
         self._ensure_type_annotations(funcs)
         self._ensure_no_overlap(funcs)
         self._api_funcs.update(funcs)
+        self._versions.update(key[0] for key in funcs)
+        self._routes.clear()
         if not getattr(api_fragment, "log", None):
             api_fragment.log = self.log
 
     def isversion(self, version):
-        for key in self._api_funcs:
-            if version == key[0]:
-                return True
+        return version in self._versions
 
     def has_api_fn(self, fn_name, version, namespace):
         return (version, fn_name, namespace) in self._api_funcs
@@ -397,6 +608,9 @@ class API(object):
     def get_api_fn(self, fn_name, version, namespace):
         return self._api_funcs[(version, fn_name, namespace)]
 
+    def find_api_fn(self, fn_name, version, namespace):
+        return self._api_funcs.get((version, fn_name, namespace))
+
 
 class BaseRequestHandler(object):
     PROTOCOLS = PROTOCOLS
@@ -422,13 +636,19 @@ class BaseRequestHandler(object):
 
         self.log = log
 
-        self._protocols = self.PROTOCOLS
+        # a copy, so that registering a protocol doesn't
+        # affect other handlers (or the module level PROTOCOLS)
+        self._protocols = dict(self.PROTOCOLS)
+        if default_protocol not in self._protocols:
+            raise UnknownProtocol(default_protocol)
+        self._default_protocol = self._protocols[default_protocol]
 
     def set_default_protocol(self, default_proto=DEFAULT_PROTOCOL):
-        if protocol not in self.PROTOCOLS:
-            raise UnknownProtocol(protocol)
+        if default_proto not in self._protocols:
+            raise UnknownProtocol(default_proto)
 
-        self.default_protocol = protocol
+        self.default_protocol = default_proto
+        self._default_protocol = self._protocols[default_proto]
 
     def register_protocol(self, protocol, update=True):
         name = protocol.get_name()
@@ -436,21 +656,16 @@ class BaseRequestHandler(object):
             raise ProtocolAlreadyExists(protocol)
         self._protocols[name] = protocol
 
-    def _resolve_call_info(self, request):
-        r = AttrDict()
-        r.time_deserialize = 0.0
-        r.namespace = None
-        r.function = None
-        r.method = "GET"
+        if name == self.default_protocol:
+            self._default_protocol = protocol
 
-        urlp = urlparse(request.url)
-        path_parts = urlp.path.lstrip("/").split("/")
+    def _resolve_route(self, path):
+        path_parts = path.lstrip("/").split("/")
         path_parts = path_parts[1:]  # ignore "/api/" part
 
         version = path_parts[0]
         fn_name = path_parts[-1]
         path_parts = path_parts[:-1]
-        r.function = fn_name
 
         if self.api.isversion(version):
             namespace = "/".join(path_parts[1:])
@@ -459,62 +674,73 @@ class BaseRequestHandler(object):
             namespace = "/".join(path_parts)
 
         namespace = namespace if namespace else None
+        return fn_name, namespace, self.api.find_api_fn(fn_name, version, namespace)
+
+    def _resolve_call_info(self, request, protocol=None):
+        r = _CallInfo()
+
+        url = request.url
+        # request urls are usually just "/path?query", which doesn't need
+        # the full generality (and cost) of urlparse; it's still used for
+        # anything else, eg: urls with a scheme or netloc, a fragment or
+        # ";params" (which urlparse strips from the path)
+        if url[:1] == "/" and not ("//" in url or "#" in url or ";" in url):
+            path, _, query_string = url.partition("?")
+        else:
+            urlp = urlparse(url)
+            path, query_string = urlp.path, urlp.query
+
+        routes = self.api._routes
+        route = routes.get(path)
+        if route is None:
+            route = self._resolve_route(path)
+            if route[2] is not None:
+                if len(routes) >= self.api.ROUTE_CACHE_SIZE:
+                    routes.clear()
+                routes[path] = route
+
+        fn_name, namespace, fninfo = route
+        r.function = fn_name
         r.namespace = namespace or ""
 
-        request.log = self.log.bind(
-            __requestid=request.id,
-            namespace=r.namespace,
-            function=fn_name,
-            apiid=self.api._id,
-        )
-
-        query_string = urlp.query
+        # binding allocates a new logger (and request.id reads the
+        # headers), which is wasted work when logging is off
+        if self.log is DUMMY_LOG:
+            request.log = DUMMY_LOG
+        else:
+            request.log = self.log.bind(
+                __requestid=request.id,
+                namespace=r.namespace,
+                function=fn_name,
+                apiid=self.api._id,
+            )
 
         request.fn_name = fn_name
-        if not self.api.has_api_fn(fn_name, version, namespace):
+        if fninfo is None:
             raise UnknownAPIFunction(fn_name)
 
-        fninfo = self.api.get_api_fn(fn_name, version, namespace)
         request.fn = fninfo["obj"]
-        info = fninfo["info"]
-        params = info["params"]
+        r.gives_stream = fninfo["gives_stream"]
 
         # parse function arguments from the request
-        param_vals = dict((k, v[0]) for k, v in parse_qs(query_string).items())
-
-        for key, val in param_vals.items():
-            try:
-                if params.get(key, {}).get("type", "") == type(val):
-                    continue
-                param_vals[key] = ast.literal_eval(val)
-            except:  # FIXME: bald except!
-                param_vals[key] = val
+        param_vals = fninfo["parse_params"](query_string)
 
         if request.method == "POST":
             r.method = "POST"
-            protocol = self._find_request_protocol(request)
-
-            for stream_param in params:
-                try:
-                    if params[stream_param]["type"] == typing.Generator:
-                        stream_param = stream_param
-                        break
-                except AttributeError:
-                    continue
-            else:
-                stream_param = None
+            protocol = protocol or self._find_request_protocol(request)
+            stream_param = fninfo["stream_param"]
 
             # FIXME: request.body: what type is it supposed to be? byte string or file like?
             if not stream_param:
-                t = time.time()
-                p = protocol.deserialize(request.body)
-                r.deserialize_time = time.time() - t
+                t = time.perf_counter()
+                body_params = protocol.deserialize(request.body)
+                r.time_deserialize = time.perf_counter() - t
 
-                param_vals.update(protocol.deserialize(request.body))
+                param_vals.update(body_params)
             else:
                 param_vals[stream_param] = protocol.deserialize_stream(request.body)
 
-        if info.get("req", None):
+        if fninfo["has_req"]:
             param_vals["req"] = request
 
         request.fn_params = param_vals
@@ -522,18 +748,22 @@ class BaseRequestHandler(object):
         return r
 
     def _find_request_protocol(self, r):
-        protocol = r.headers.get(PROTOCOL_HEADER, self.default_protocol)
-        return self.PROTOCOLS[protocol]
+        protocol = r.headers.get(PROTOCOL_HEADER, None)
+        if not protocol:
+            return self._default_protocol
+        return self._protocols.get(protocol, self._default_protocol)
 
-    def _find_response_protocol(self, r):
+    def _find_response_protocol(self, r, request_protocol=None):
         protocol = r.response.headers.get(PROTOCOL_HEADER, None)
         if protocol:
-            return self.PROTOCOLS[protocol]
-        return self._find_request_protocol(r)
+            return self._protocols[protocol]
+        return request_protocol or self._find_request_protocol(r)
 
     def _handle_exception(self, req, e):
-        message_value = e.message if hasattr(e, "message") else str(e)
-        code_value = e.code if hasattr(e, "code") else self.DEFAULT_ERROR_CODE
+        message_value = getattr(e, "message", None)
+        if message_value is None:
+            message_value = str(e)
+        code_value = getattr(e, "code", self.DEFAULT_ERROR_CODE)
         error_value = "[(%s) %s]" % (self.api._id, e.__class__.__name__)
         success_value = False
         message = dict(
@@ -543,7 +773,7 @@ class BaseRequestHandler(object):
             success=success_value,
         )
 
-        _log = req.log if hasattr(req, "log") else self.log
+        _log = getattr(req, "log", self.log)
         _log.exception(
             "handle_request_error",
             message=message,
@@ -587,15 +817,15 @@ class BaseRequestHandler(object):
         response.headers["Content-Type"] = protocol.get_mime_type()
 
         try:
-            rinfo = self._resolve_call_info(request)
+            rinfo = self._resolve_call_info(request, protocol)
 
             # invoke the API function
-            tcompute = time.time()
+            tcompute = time.perf_counter()
             try:
                 self._invoke_pre_call_hook(request)
                 result = request.fn(**request.fn_params)
 
-                protocol = self._find_response_protocol(request)
+                protocol = self._find_response_protocol(request, protocol)
 
                 self._invoke_post_call_hook(request, result=result)
 
@@ -607,42 +837,48 @@ class BaseRequestHandler(object):
                 else:
                     raise e
 
-            tcompute = time.time() - tcompute
+            tcompute = time.perf_counter() - tcompute
 
             # Serialize the response
-            if request.fn.__func__.func_info["gives_stream"]:
+            if rinfo.gives_stream:
                 result = (
                     self._wrap_stream(request, result)
                     if protocol.should_wrap()
                     else result
                 )
                 n, t = response.write(result, protocol, stream=True)
+            elif protocol.should_wrap():
+                ts = time.perf_counter()
+                result = protocol.serialize_result(result)
+                ts = time.perf_counter() - ts
+
+                # the result is already serialized, so write it as is
+                n, t = response.write(result, RawProtocol)
+                t.increment(ts)
             else:
-                result = (
-                    dict(success=True, result=result)
-                    if protocol.should_wrap()
-                    else result
-                )
                 n, t = response.write(result, protocol)
 
             response.headers[TIMING_HEADER] = str(
                 tcompute + t.value + rinfo.time_deserialize
             )
 
-            request.log.info(
-                "kwikapi.handle_request",
-                function=rinfo.function,
-                namespace=rinfo.namespace,
-                method=rinfo.method,
-                compute_time=tcompute,
-                serialize_time=t.value,
-                deserialize_time=rinfo.time_deserialize,
-                __params=get_loggable_params(request.fn_params or {}),
-                protocol=request.protocol,
-                type="logged_metric",
-                num_req=1,
-                **request.metrics
-            )
+            # skip building the metrics (and loggable params)
+            # when nothing is going to log them
+            if self.log is not DUMMY_LOG:
+                request.log.info(
+                    "kwikapi.handle_request",
+                    function=rinfo.function,
+                    namespace=rinfo.namespace,
+                    method=rinfo.method,
+                    compute_time=tcompute,
+                    serialize_time=t.value,
+                    deserialize_time=rinfo.time_deserialize,
+                    __params=get_loggable_params(request.fn_params or {}),
+                    protocol=request.protocol,
+                    type="logged_metric",
+                    num_req=1,
+                    **request.metrics
+                )
 
         except Exception as e:
             self._invoke_post_call_hook(request, exception=e)
@@ -1,4 +1,5 @@
 import typing
+from collections import defaultdict
 
 from .exception import UnknownVersionOrNamespace, UnknownVersion
 
@@ -7,6 +8,11 @@ class ApiDoc(object):
     def __init__(self, api_funcs):
         self.api_funcs = api_funcs
 
+        # the docs only change when functions get registered, so they
+        # are built once and rebuilt only when api_funcs has changed
+        self._docs = None
+        self._docs_funcs = None
+
     def _type_str(self, t):
         if t is None:
             return str(None)
@@ -19,11 +25,20 @@ class ApiDoc(object):
             except Exception:
                 return "Unknown"
 
-    def apidoc(self, version: str = None, namespace: str = None) -> dict:
-        versions = {}
-        namespaces = {}
+    def _get_docs(self):
+        # registry entries are replaced (not mutated) on registration,
+        # so comparing them (by identity first) tells if anything changed
+        funcs = list(self.api_funcs.values())
+        if self._docs is None or funcs != self._docs_funcs:
+            self._docs = self._make_docs()
+            self._docs_funcs = funcs
+
+        return self._docs
+
+    def _make_docs(self):
+        versions = defaultdict(dict)
+        namespaces = defaultdict(dict)
 
-        # FIXME: Why every time looping when the api method is called.
         for (ver, fn_name, nsp), fninfo in self.api_funcs.items():
             # We don't need to show apidoc API in  apidoc API results
             if fn_name == "apidoc":
@@ -48,27 +63,26 @@ class ApiDoc(object):
                 fninfo["info"]["return_type"]
             )
 
-            vfns = versions.get(ver, {})
-            vfns[fn_name] = fninfo["info"]
-            versions[ver] = vfns
+            versions[ver][fn_name] = fninfo["info"]
 
             if nsp:
-                key = str((ver, nsp))
-                nsfns = namespaces.get(key, {})
-                nsfns[fn_name] = fninfo["info"]
-                namespaces[key] = nsfns
-
-        try:
-            if version and namespace:
-                return namespaces[str((version, namespace))]
-        except KeyError:
-            raise UnknownVersionOrNamespace((version, namespace))
-
-        try:
-            if version:
-                return versions[version]
-        except KeyError:
-            raise UnknownVersion(version)
+                namespaces[str((ver, nsp))][fn_name] = fninfo["info"]
+
+        return dict(versions), dict(namespaces)
+
+    def apidoc(self, version: str = None, namespace: str = None) -> dict:
+        versions, namespaces = self._get_docs()
+
+        if version and namespace:
+            key = str((version, namespace))
+            if key not in namespaces:
+                raise UnknownVersionOrNamespace((version, namespace))
+            return namespaces[key]
+
+        if version:
+            if version not in versions:
+                raise UnknownVersion(version)
+            return versions[version]
 
         res = dict(version=versions, namespace=namespaces)
 
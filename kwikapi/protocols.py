@@ -1,13 +1,34 @@
 import ast
 import abc
 import json
+import threading
 import msgpack
 import numpy as np
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 from .exception import StreamingNotSupported
 from .utils import walk_data_structure, liteval
 
 
+def _json_dumps(data):
+    return json.dumps(data).encode("utf-8")
+
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def _orjson_dumps(data):
+        try:
+            return orjson.dumps(data, option=_ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            # eg: integers wider than 64 bits, which stdlib json can handle
+            return _json_dumps(data)
+
+
 class BaseProtocol(object):
     __metaclass__ = abc.ABCMeta
 
@@ -47,17 +68,62 @@ class BaseProtocol(object):
         """
         return True
 
+    @classmethod
+    def serialize_result(cls, result):
+        """
+        Serializes the wrapped response of a successful
+        call, ie: {success: True, result: value}
+        Protocols can override this method to avoid
+        building the wrapper dict on every response.
+        """
+        return cls.serialize(dict(success=True, result=result))
+
 
 class JsonProtocol(BaseProtocol):
     @staticmethod
     def get_name():
         return "json"
 
-    @staticmethod
-    def serialize(data):
-        data = json.dumps(data)
+    # what json.dumps (and orjson.dumps) write for the start and end of
+    # {"success": True, "result": ...}
+    RESULT_PREFIX = b'{"success": true, "result": '
+    ORJSON_RESULT_PREFIX = b'{"success":true,"result":'
+    RESULT_SUFFIX = b"}"
 
-        return data.encode("utf-8")
+    # Serialize with orjson (when it is installed), which is much faster
+    # than the json module but writes NaN and Infinity as null. Decoding
+    # always uses the json module, so that wide integers don't lose
+    # precision and NaN/Infinity in request bodies are accepted.
+    USE_ORJSON = False
+
+    @classmethod
+    def _dumps(cls, data):
+        if cls.USE_ORJSON and orjson is not None:
+            return _orjson_dumps(data)
+        return _json_dumps(data)
+
+    @classmethod
+    def serialize(cls, data):
+        return cls._dumps(data)
+
+    @classmethod
+    def serialize_result(cls, result):
+        # subclasses that serialize differently (eg: json.dumps with
+        # default=str) must get the whole envelope passed to serialize
+        if getattr(cls.serialize, "__func__", None) is not _json_serialize:
+            return super().serialize_result(result)
+
+        prefix = cls.RESULT_PREFIX
+        if cls.USE_ORJSON and orjson is not None:
+            try:
+                data = orjson.dumps(result, option=_ORJSON_OPTIONS)
+                prefix = cls.ORJSON_RESULT_PREFIX
+            except orjson.JSONEncodeError:
+                data = _json_dumps(result)
+        else:
+            data = _json_dumps(result)
+
+        return b"".join((prefix, data, cls.RESULT_SUFFIX))
 
     @staticmethod
     def deserialize(data):
@@ -70,21 +136,53 @@ class JsonProtocol(BaseProtocol):
 
     @staticmethod
     def get_record_separator():
-        return "\n"
+        return b"\n"
 
     @staticmethod
     def get_mime_type():
         return "application/json"
 
 
+_json_serialize = JsonProtocol.serialize.__func__
+
+
 class MessagePackProtocol(BaseProtocol):
     @staticmethod
     def get_name():
         return "messagepack"
 
-    @staticmethod
-    def serialize(data):
-        return msgpack.packb(data)
+    _local = threading.local()
+
+    @classmethod
+    def _get_packer(cls):
+        # msgpack.packb builds a new Packer on every call, so keep one
+        # around per thread (Packer objects aren't thread safe)
+        packer = getattr(cls._local, "packer", None)
+        if packer is None:
+            packer = cls._local.packer = msgpack.Packer()
+
+        return packer
+
+    @classmethod
+    def serialize(cls, data):
+        try:
+            return cls._get_packer().pack(data)
+        except Exception:
+            # don't reuse a packer that may hold a partially packed buffer
+            cls._local.packer = None
+            raise
+
+    # a fixmap of 2 entries with "success": True followed by the "result" key
+    RESULT_PREFIX = b"\x82\xa7success\xc3\xa6result"
+
+    @classmethod
+    def serialize_result(cls, result):
+        # as with JsonProtocol, only splice the envelope when
+        # serialize hasn't been overridden
+        if getattr(cls.serialize, "__func__", None) is not _msgpack_serialize:
+            return super().serialize_result(result)
+
+        return cls.RESULT_PREFIX + cls.serialize(result)
 
     @staticmethod
     def deserialize(data):
@@ -98,13 +196,16 @@ class MessagePackProtocol(BaseProtocol):
 
     @staticmethod
     def get_record_separator():
-        return ""
+        return b""
 
     @staticmethod
     def get_mime_type():
         return "application/x-msgpack"
 
 
+_msgpack_serialize = MessagePackProtocol.serialize.__func__
+
+
 class RawProtocol(BaseProtocol):
     @staticmethod
     def get_name():
@@ -188,8 +289,8 @@ class NumpyProtocol(BaseProtocol):
     def deserialize_stream(cls, data):
         raise StreamingNotSupported(cls.get_name())
 
-    @staticmethod
-    def get_record_separator():
+    @classmethod
+    def get_record_separator(cls):
         raise StreamingNotSupported(cls.get_name())
 
     @staticmethod
@@ -1,4 +1,5 @@
 import ast
+from urllib.parse import unquote_plus
 import numpy as np
 
 
@@ -42,15 +43,79 @@ def to_python_type(data):
     return data
 
 
+# characters a python literal can start with (numbers, containers,
+# strings with or without a prefix, True/False/None and leading
+# whitespace); anything else can't be one, so isn't worth parsing
+_LITERAL_STARTS = frozenset("0123456789-+.[{(\"'TFNbBrRuU \t")
+
+
 def liteval(x):
+    if isinstance(x, str) and x[:1] not in _LITERAL_STARTS:
+        return x
+
     try:
         x = ast.literal_eval(x)
-    except Exception:
+    except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
         pass
 
     return x
 
 
+def parse_query(query_string):
+    """
+    Parses a query string into a dict of values. Like parse_qs, blank
+    values are dropped and the first value of a repeated key is kept,
+    but no list is built per key.
+    """
+    params = {}
+    for pair in query_string.split("&"):
+        key, _, val = pair.partition("=")
+        if not val:
+            continue
+
+        key = unquote_plus(key)
+        if key not in params:
+            params[key] = unquote_plus(val)
+
+    return params
+
+
+def _make_number_converter(_type):
+    def _convert(x):
+        try:
+            return _type(x)
+        except ValueError:
+            return liteval(x)
+
+    return _convert
+
+
+def _to_bool(x):
+    v = x.lower()
+    if v in ("true", "1", "yes"):
+        return True
+    if v in ("false", "0", "no"):
+        return False
+
+    return liteval(x)
+
+
+CONVERTERS = {
+    str: lambda x: x,
+    int: _make_number_converter(int),
+    float: _make_number_converter(float),
+    bool: _to_bool,
+}
+
+
+def get_converter(_type):
+    """Returns the callable that converts a query string value to `_type`"""
+    try:
+        return CONVERTERS.get(_type, liteval)
+    except TypeError:  # unhashable annotation, eg: [int, int]
+        return liteval
+
+
 def get_loggable_params(kwargs):
     _kwargs = {}
 
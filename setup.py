@@ -23,6 +23,7 @@ setup(
     extras_require={
         "django": ["kwikapi-django==0.2.6"],
         "tornado": ["kwikapi-tornado==0.3.8"],
+        "orjson": ["orjson==3.8.3"],
         "all": ["kwikapi-django==0.2.6", "kwikapi-tornado==0.3.7"],
     },
     classifiers=[